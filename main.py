@@ -1,13 +1,24 @@
-import json
+import atexit
 import os
+import queue
+import tempfile
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
+from typing import IO
 
 import boto3
-import requests
+import httpx
+import orjson
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from playwright.sync_api import sync_playwright, Page, BrowserContext
+from playwright.sync_api import sync_playwright, Browser, BrowserContext, Locator, Page, Playwright, Route
+from playwright.sync_api import Error as PlaywrightError
 
 from opt_token import get_opt_token
 from dotenv import load_dotenv
@@ -50,35 +61,196 @@ LOGIN_URL = _get_env_var("INVIU_LOGIN_URL", default="https://asesor.inviu.com.ar
 EMAIL = _get_env_var("EMAIL", required=True)
 PASSWORD = _get_env_var("PASSWORD", required=True)
 WAIT_TIME_FOR_TOKEN = _get_int_env("OTP_WAIT_SECONDS", 2 * 60)
+OTP_CLOCK_SKEW_SECONDS = _get_int_env("OTP_CLOCK_SKEW_SECONDS", 30)
 PLAYWRIGHT_HEADLESS = _get_bool_env("PLAYWRIGHT_HEADLESS", default=False)
 LOCAL_STORAGE_TOKEN_KEY = _get_env_var("TOKENS_KEY", default="TOKENS_KEY")
-API_BASE_URL = _get_env_var("INVIU_API_BASE_URL", default="https://inviuxy.inviu.com.ar")
+API_BASE_URL = _get_env_var("INVIU_API_BASE_URL", default="https://inviuxy.inviu.com.ar").rstrip("/")
+
+# Session reuse
+SESSION_STATE_PATH = _get_env_var("SESSION_STATE_PATH", default="session_state.json")
+SESSION_STATE_TTL_SECONDS = _get_int_env("SESSION_STATE_TTL_SECONDS", 8 * 60 * 60)
+TOKEN_CACHE_PATH = Path(
+    _get_env_var("TOKEN_CACHE_PATH", default=str(Path.home() / ".dracma" / "tokens.json"))
+).expanduser()
+ID_TOKEN_MAX_AGE_SECONDS = _get_int_env("ID_TOKEN_MAX_AGE_SECONDS", 45 * 60)
 
 # S3 Configuration
 S3_BUCKET_NAME = _get_env_var("S3_BUCKET_NAME", default="dracma-data-lake")
 S3_REGION = _get_env_var("S3_REGION", default="us-east-2")
 S3_PREFIX = _get_env_var("S3_PREFIX", default="raw")
 
+# Large payloads switch to concurrent multipart uploads past this size
+S3_MULTIPART_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Streamed API responses are read in chunks of this size
+API_STREAM_CHUNK_BYTES = 64 * 1024
+
+# S3 upload bodies are kept in memory up to this size, then spill to a temp file
+S3_SPOOL_MAX_BYTES = 4 * 1024 * 1024
+
+# Concurrency
+API_MAX_WORKERS = _get_int_env("API_MAX_WORKERS", 8)
+S3_UPLOAD_WORKERS = _get_int_env("S3_UPLOAD_WORKERS", 4)
+
+
+# ============================================================================
+# HTTP Client
+# ============================================================================
+
+# Statuses worth retrying; only idempotent methods are retried
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+RETRY_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+API_MAX_RETRIES = 3
+API_RETRY_BACKOFF_SECONDS = 0.3
+# Statuses whose Retry-After header is honoured, and the longest wait accepted
+RETRY_AFTER_STATUS_CODES = frozenset({429, 503})
+API_RETRY_AFTER_MAX_SECONDS = 30.0
+
+
+def _build_http_client() -> httpx.Client:
+    """
+    Build an HTTP/2 client for API_BASE_URL.
+    
+    With HTTP/2 the concurrent API calls are multiplexed over a single TLS
+    connection instead of opening one socket per worker thread.
+    
+    Returns:
+        Configured httpx Client
+    """
+    limits = httpx.Limits(
+        max_connections=API_MAX_WORKERS,
+        max_keepalive_connections=API_MAX_WORKERS,
+    )
+    # retries here only covers connection failures; status retries are in _send_with_retries
+    transport = httpx.HTTPTransport(http2=True, retries=API_MAX_RETRIES, limits=limits)
+    # httpx advertises every encoding it can decode (br with the brotli package)
+    headers = {
+        "Accept": "application/json",
+    }
+    return httpx.Client(transport=transport, headers=headers, timeout=30)
+
+
+def _retry_after_seconds(response: httpx.Response) -> float | None:
+    """
+    Read the wait requested by a Retry-After header.
+    
+    Args:
+        response: Response with a retryable status
+        
+    Returns:
+        Seconds to wait (capped at API_RETRY_AFTER_MAX_SECONDS), or None if the
+        header is missing or unparseable
+    """
+    if response.status_code not in RETRY_AFTER_STATUS_CODES:
+        return None
+    
+    raw = response.headers.get("retry-after")
+    if not raw:
+        return None
+    
+    # Either delay-seconds or an HTTP-date
+    raw = raw.strip()
+    if raw.isdigit():
+        seconds = float(raw)
+    else:
+        try:
+            retry_at = parsedate_to_datetime(raw)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        seconds = (retry_at - datetime.now(timezone.utc)).total_seconds()
+    
+    return min(max(seconds, 0.0), API_RETRY_AFTER_MAX_SECONDS)
+
+
+def _send_with_retries(method: str, url: str, stream: bool = False, **kwargs) -> httpx.Response:
+    """
+    Send a request, retrying idempotent methods on transient HTTP statuses.
+    
+    Waits as long as the server's Retry-After asks (see _retry_after_seconds),
+    falling back to exponential backoff.
+    
+    Args:
+        method: HTTP method
+        url: Absolute URL
+        stream: Return without reading the body; the caller must close the response
+        **kwargs: Additional arguments to pass to httpx (headers, json, params, etc.)
+        
+    Returns:
+        Last response received
+    """
+    request = _HTTP_CLIENT.build_request(method, url, **kwargs)
+    attempt = 0
+    while True:
+        response = _HTTP_CLIENT.send(request, stream=stream)
+        if (
+            response.status_code not in RETRY_STATUS_CODES
+            or method.upper() not in RETRY_METHODS
+            or attempt >= API_MAX_RETRIES
+        ):
+            return response
+        
+        delay = _retry_after_seconds(response)
+        if delay is None:
+            delay = API_RETRY_BACKOFF_SECONDS * (2 ** attempt)
+        response.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+# Shared across refresh and API calls (thread-safe)
+_HTTP_CLIENT = _build_http_client()
+atexit.register(_HTTP_CLIENT.close)
+
+
+def _set_bearer_token(token: str) -> None:
+    """Attach the Bearer token to every subsequent request made by the shared client."""
+    _HTTP_CLIENT.headers["Authorization"] = f"Bearer {token}"
+
 
 # ============================================================================
 # OTP Token Functions
 # ============================================================================
 
-def wait_for_token(wait_time: int = WAIT_TIME_FOR_TOKEN) -> str:
+def wait_for_token(wait_time: int = WAIT_TIME_FOR_TOKEN, requested_at: datetime | None = None) -> str:
     """
-    Wait for the email token to arrive and retrieve it from Microsoft Graph Mail
+    Poll Microsoft Graph Mail until the OTP email arrives, with exponential backoff
     
     Args:
-        wait_time: Time to wait in seconds (default: 2 minutes)
+        wait_time: Maximum time to wait in seconds (default: 2 minutes)
+        requested_at: When the OTP was requested (UTC); older emails are ignored.
+            Defaults to now.
         
     Returns:
         OTP token string
     """
-    time.sleep(wait_time)
-    token = get_opt_token()
-    if not token:
-        raise RuntimeError("No OTP token received from get_opt_token()")
-    return token
+    deadline = time.monotonic() + wait_time
+    if requested_at is None:
+        requested_at = datetime.now(timezone.utc)
+    # Tolerate small differences between our clock and the mail server's
+    received_after = requested_at - timedelta(seconds=OTP_CLOCK_SKEW_SECONDS)
+    delay = 2.0
+    
+    last_error: Exception | None = None
+    
+    while True:
+        try:
+            token = get_opt_token(received_after=received_after)
+        except Exception as e:
+            # A throttled or failed Graph call only costs this attempt
+            logger.warning(f"⚠️ Error consultando el OTP, se reintenta: {e}")
+            last_error = e
+            token = None
+        if token:
+            return token
+        
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise RuntimeError("No OTP token received from get_opt_token()") from last_error
+        
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 1.5, 10.0)
 
 
 # ============================================================================
@@ -95,7 +267,7 @@ def _extract_tokens_from_local_storage(page: Page, key: str) -> dict[str, str] |
         return None
     
     try:
-        tokens_data = json.loads(raw_value)
+        tokens_data = orjson.loads(raw_value)
         id_token = tokens_data.get("idToken")
         refresh_token = tokens_data.get("refreshToken")
         
@@ -105,7 +277,7 @@ def _extract_tokens_from_local_storage(page: Page, key: str) -> dict[str, str] |
                 "refreshToken": refresh_token
             }
         return None
-    except (json.JSONDecodeError, AttributeError):
+    except (orjson.JSONDecodeError, AttributeError):
         return None
 
 
@@ -122,7 +294,7 @@ def _extract_token_from_local_storage(page: Page, key: str) -> str | None:
 # Token Refresh Functions
 # ============================================================================
 
-def refresh_token(id_token: str, refresh_token: str) -> str | None:
+def refresh_token(id_token: str, refresh_token: str) -> dict[str, str] | None:
     """
     Refresh the authentication token using the refresh token endpoint.
     
@@ -131,7 +303,9 @@ def refresh_token(id_token: str, refresh_token: str) -> str | None:
         refresh_token: Current refreshToken
         
     Returns:
-        New idToken if refresh successful, None otherwise
+        Dictionary with the new 'idToken' and 'refreshToken' if refresh successful,
+        None otherwise. The refreshToken is the rotated one when the server returns
+        it, the current one otherwise.
     """
     endpoint = "/advisor/auth/refresh"
     url = f"{API_BASE_URL}{endpoint}"
@@ -142,7 +316,7 @@ def refresh_token(id_token: str, refresh_token: str) -> str | None:
     
     try:
         logger.info("🔄 Refrescando token...")
-        response = requests.post(url, json=payload, timeout=30)
+        response = _HTTP_CLIENT.post(url, json=payload)
         response.raise_for_status()
         
         response_data = response.json()
@@ -150,68 +324,241 @@ def refresh_token(id_token: str, refresh_token: str) -> str | None:
         
         if new_id_token:
             logger.info("✅ Token refrescado exitosamente")
-            return new_id_token
+            return {
+                "idToken": new_id_token,
+                "refreshToken": response_data.get("refreshToken") or refresh_token
+            }
         else:
             logger.warning("⚠️ Respuesta de refresh no contiene idToken")
             return None
             
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, ValueError) as e:
         logger.error(f"❌ Error al refrescar token: {e}")
-        if hasattr(e, 'response') and e.response is not None:
+        if isinstance(e, httpx.HTTPStatusError):
             logger.error(f"Response: {e.response.text[:200]}")
         return None
 
 
+# ============================================================================
+# Session Cache Functions
+# ============================================================================
+
+def _is_fresh(path: Path, max_age_seconds: int) -> bool:
+    """Check whether a file exists and was modified less than max_age_seconds ago."""
+    try:
+        return time.time() - path.stat().st_mtime < max_age_seconds
+    except OSError:
+        return False
+
+
+def _load_cached_tokens() -> dict | None:
+    """
+    Load the tokens saved by the last successful login or refresh.
+    
+    Returns:
+        Dictionary with 'idToken', 'refreshToken' and 'saved_at' (epoch seconds),
+        or None if the cache is missing or unreadable
+    """
+    if not TOKEN_CACHE_PATH.exists():
+        return None
+    
+    try:
+        cached = orjson.loads(TOKEN_CACHE_PATH.read_bytes())
+        tokens = {
+            "idToken": cached["idToken"],
+            "refreshToken": cached["refreshToken"],
+            "saved_at": float(cached["saved_at"])
+        }
+    except (OSError, orjson.JSONDecodeError, KeyError, TypeError, ValueError):
+        logger.warning(f"⚠️ Cache de tokens ilegible en {TOKEN_CACHE_PATH}, se ignora")
+        return None
+    
+    if not tokens["idToken"] or not tokens["refreshToken"]:
+        return None
+    return tokens
+
+
+def _save_cached_tokens(tokens: dict[str, str]) -> None:
+    """
+    Persist idToken and refreshToken (readable only by the current user).
+    
+    Args:
+        tokens: Dictionary with 'idToken' and 'refreshToken'
+    """
+    payload = {
+        "idToken": tokens["idToken"],
+        "refreshToken": tokens["refreshToken"],
+        "saved_at": time.time()
+    }
+    try:
+        TOKEN_CACHE_PATH.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        fd = os.open(TOKEN_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(orjson.dumps(payload))
+        # os.open only applies the mode when creating the file
+        os.chmod(TOKEN_CACHE_PATH, 0o600)
+    except OSError as e:
+        logger.warning(f"⚠️ No se pudieron guardar los tokens en {TOKEN_CACHE_PATH}: {e}")
+
+
 # ============================================================================
 # API Call Functions
 # ============================================================================
 
-def _make_api_call(token: str, endpoint: str, method: str = "GET", **kwargs) -> dict | None:
+def _make_api_call(
+    method: str,
+    endpoint: str,
+    url: str,
+    request_kwargs: dict,
+    sink: IO[bytes],
+    stream: bool = False
+) -> bool:
     """
-    Make an API call using the Bearer token.
+    Make an API call with the shared client (see _set_bearer_token).
+    
+    The body is written to sink as raw JSON bytes and never decoded into Python
+    objects; sink is the S3 envelope opened by _open_response_envelope.
     
     Args:
-        token: The Bearer token to use for authorization
-        endpoint: API endpoint path (e.g., "/advisor/clients/accounts/CVAL")
         method: HTTP method (GET, POST, PUT, DELETE, etc.)
-        **kwargs: Additional arguments to pass to requests (data, json, params, etc.)
+        endpoint: API endpoint path (e.g., "/advisor/clients/accounts/CVAL"), for logging
+        url: Full URL to call
+        request_kwargs: Additional arguments to pass to httpx (data, json, params, etc.)
+        sink: Writable binary file that receives the decompressed response body
+        stream: Copy the body to sink chunk by chunk instead of loading it whole
+            (for large responses)
         
     Returns:
-        Response JSON as dict, or None on error
+        True if the body was written to sink, False on error or when the body is
+        empty or (without stream) not valid JSON
     """
-    url = f"{API_BASE_URL}{endpoint}"
-    headers = {"Authorization": f"Bearer {token}"}
-    
     try:
-        response = requests.request(method, url, headers=headers, timeout=30, **kwargs)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        response = _send_with_retries(method, url, stream=stream, **request_kwargs)
+        try:
+            if response.is_error:
+                # Load the error body so it can be logged below
+                response.read()
+            response.raise_for_status()
+            
+            content_type = response.headers.get("content-type", "")
+            if "json" not in content_type:
+                logger.error(f"❌ API call returned non-JSON content ({method} {endpoint}): {content_type}")
+                return False
+            
+            if stream:
+                # Too large to parse up front; at least refuse an empty body
+                written = 0
+                for chunk in response.iter_bytes(chunk_size=API_STREAM_CHUNK_BYTES):
+                    written += sink.write(chunk)
+            else:
+                body = response.content
+                try:
+                    orjson.loads(body)
+                except orjson.JSONDecodeError as e:
+                    logger.error(f"❌ API call returned invalid JSON ({method} {endpoint}): {e}")
+                    return False
+                written = sink.write(body)
+            
+            if not written:
+                logger.error(f"❌ API call returned an empty body ({method} {endpoint})")
+                return False
+            return True
+        finally:
+            response.close()
+    except httpx.HTTPError as e:
         logger.error(f"❌ API call failed ({method} {endpoint}): {e}")
-        if hasattr(e, 'response') and e.response is not None:
+        if isinstance(e, httpx.HTTPStatusError):
             logger.error(f"Response: {e.response.text[:200]}")
-        return None
+        return False
+
+
+_S3_CLIENT = None
+_S3_CLIENT_LOCK = threading.Lock()
 
 
 def _get_s3_client():
     """
     Get or create S3 client.
     
+    The client is created once and shared by every upload worker (boto3 clients
+    are thread-safe, but creating them concurrently is not).
+    
     Returns:
         boto3 S3 client
     """
-    return boto3.client('s3', region_name=S3_REGION)
+    global _S3_CLIENT
+    with _S3_CLIENT_LOCK:
+        if _S3_CLIENT is None:
+            config = Config(
+                # Keep enough pooled connections for every upload worker
+                max_pool_connections=max(16, S3_UPLOAD_WORKERS),
+                retries={"max_attempts": 3, "mode": "adaptive"},
+            )
+            _S3_CLIENT = boto3.client('s3', region_name=S3_REGION, config=config)
+        return _S3_CLIENT
+
 
+_S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=S3_MULTIPART_CHUNK_BYTES,
+    multipart_chunksize=S3_MULTIPART_CHUNK_BYTES,
+    max_concurrency=4,
+)
 
-def _save_api_response(endpoint: str, response_data: dict, method: str = "GET", name: str | None = None) -> str:
+
+def _sanitize_endpoint_name(endpoint: str) -> str:
+    """Turn an endpoint path into a string safe to use as a filename."""
+    return endpoint.replace("/", "_").replace("\\", "_").strip("_").replace("?", "_")
+
+
+def _open_response_envelope(
+    endpoint: str,
+    method: str = "GET",
+    url: str | None = None,
+    timestamp: str | None = None
+) -> IO[bytes]:
     """
-    Save API response to S3 bucket.
+    Start the S3 document for an API response.
+    
+    Writes {<metadata>,"data": to a spooled temp file so the raw payload can be
+    appended right after it without re-serializing; _save_api_response adds
+    the closing brace before uploading.
     
     Args:
         endpoint: API endpoint path
-        response_data: Response data to save
         method: HTTP method used
+        url: Precomputed full URL (default: API_BASE_URL + endpoint)
+        timestamp: Batch timestamp in ISO format (default: now)
+        
+    Returns:
+        Spooled temp file positioned after "data":
+    """
+    metadata = {
+        "timestamp": timestamp or datetime.now().isoformat(),
+        "method": method,
+        "endpoint": endpoint,
+        "url": url or f"{API_BASE_URL}{endpoint}"
+    }
+    
+    envelope = tempfile.SpooledTemporaryFile(max_size=S3_SPOOL_MAX_BYTES)
+    envelope.write(orjson.dumps(metadata)[:-1])
+    envelope.write(b',"data":')
+    return envelope
+
+
+def _save_api_response(
+    endpoint: str,
+    envelope: IO[bytes],
+    name: str | None = None,
+    date: str | None = None
+) -> str:
+    """
+    Save API response to S3 bucket.
+    
+    Args:
+        endpoint: API endpoint path
+        envelope: Document from _open_response_envelope with the payload written
         name: Friendly name for the endpoint (used in filename)
+        date: Batch date as YYYYMMDD (default: today)
         
     Returns:
         S3 key (path) of the saved file
@@ -221,47 +568,106 @@ def _save_api_response(endpoint: str, response_data: dict, method: str = "GET",
         filename_base = name
     else:
         # Fallback to sanitized endpoint if no name provided
-        filename_base = endpoint.replace("/", "_").replace("\\", "_").strip("_").replace("?", "_")
+        filename_base = _sanitize_endpoint_name(endpoint)
     
-    date = datetime.now().strftime("%Y%m%d")
+    date = date or datetime.now().strftime("%Y%m%d")
     filename = f"{filename_base}_{date}.json"
     
     # Create S3 key with prefix
     s3_key = f"{S3_PREFIX}/{filename}"
     
-    # Prepare response with metadata
-    output = {
-        "timestamp": datetime.now().isoformat(),
-        "method": method,
-        "endpoint": endpoint,
-        "url": f"{API_BASE_URL}{endpoint}",
-        "data": response_data
-    }
-    
-    # Convert to JSON string
-    json_content = json.dumps(output, indent=2, ensure_ascii=False)
+    envelope.write(b'}')
+    envelope.seek(0)
     
     try:
         # Upload to S3
         s3_client = _get_s3_client()
-        s3_client.put_object(
-            Bucket=S3_BUCKET_NAME,
-            Key=s3_key,
-            Body=json_content.encode('utf-8'),
-            ContentType='application/json'
+        s3_client.upload_fileobj(
+            envelope,
+            S3_BUCKET_NAME,
+            s3_key,
+            ExtraArgs={'ContentType': 'application/json'},
+            Config=_S3_TRANSFER_CONFIG
         )
         
         s3_path = f"s3://{S3_BUCKET_NAME}/{s3_key}"
         return s3_path
         
-    except ClientError as e:
+    except (ClientError, S3UploadFailedError) as e:
         logger.error(f"❌ Error uploading to S3: {e}")
         raise
 
 
-def perform_api_calls(token: str, endpoints: list[dict]) -> dict[str, dict | None]:
+# ============================================================================
+# Background Upload Functions
+# ============================================================================
+
+_UPLOAD_QUEUE: queue.Queue = queue.Queue()
+_UPLOAD_WORKERS: list[threading.Thread] = []
+_UPLOAD_WORKERS_LOCK = threading.Lock()
+# Outcome of each upload since the last wait_for_uploads(): name -> uploaded
+_UPLOAD_RESULTS: dict[str, bool] = {}
+_UPLOAD_RESULTS_LOCK = threading.Lock()
+
+
+def _upload_worker() -> None:
+    """Consume queued API responses and upload them to S3."""
+    while True:
+        endpoint, envelope, name, date = _UPLOAD_QUEUE.get()
+        uploaded = False
+        try:
+            filepath = _save_api_response(endpoint, envelope, name=name, date=date)
+            logger.info(f"💾 Response saved to: {filepath}")
+            uploaded = True
+        except Exception:
+            logger.error(f"❌ Failed to save response: {name}", exc_info=True)
+        finally:
+            with _UPLOAD_RESULTS_LOCK:
+                _UPLOAD_RESULTS[name] = uploaded
+            envelope.close()
+            _UPLOAD_QUEUE.task_done()
+
+
+def _start_upload_workers() -> None:
+    """Start the S3 upload worker threads if they are not already running."""
+    with _UPLOAD_WORKERS_LOCK:
+        if _UPLOAD_WORKERS:
+            return
+        
+        # Build the shared client before any worker needs it
+        _get_s3_client()
+        
+        for index in range(max(1, S3_UPLOAD_WORKERS)):
+            worker = threading.Thread(
+                target=_upload_worker,
+                name=f"s3-upload-{index}",
+                daemon=True
+            )
+            worker.start()
+            _UPLOAD_WORKERS.append(worker)
+
+
+def wait_for_uploads() -> dict[str, bool]:
     """
-    Perform multiple API calls and save responses.
+    Block until every queued API response has been uploaded to S3.
+    
+    Returns:
+        Dictionary mapping endpoint names to whether their upload succeeded,
+        for the uploads finished since the previous call
+    """
+    _UPLOAD_QUEUE.join()
+    with _UPLOAD_RESULTS_LOCK:
+        uploads = dict(_UPLOAD_RESULTS)
+        _UPLOAD_RESULTS.clear()
+    return uploads
+
+
+def perform_api_calls(token: str, endpoints: list[dict]) -> dict[str, bool]:
+    """
+    Perform multiple API calls concurrently and queue responses for upload.
+    
+    Uploads run on background workers; call wait_for_uploads() before exiting
+    to find out which of them reached S3.
     
     Args:
         token: Bearer token for authentication
@@ -269,34 +675,61 @@ def perform_api_calls(token: str, endpoints: list[dict]) -> dict[str, dict | Non
             - "endpoint": API path (required)
             - "method": HTTP method (default: "GET")
             - "name": Friendly name for logging (optional)
-            - Additional kwargs for requests (data, json, params, etc.)
+            - "url": Precomputed full URL (optional, see get_api_endpoints)
+            - "stream": Read the response in chunks (optional, for large payloads)
+            - Additional kwargs for httpx (data, json, params, etc.)
     
     Returns:
-        Dictionary mapping endpoint names to responses (or None if failed)
+        Dictionary mapping endpoint names to whether the call succeeded
     """
-    results = {}
+    if not endpoints:
+        return {}
     
-    for config in endpoints:
-        endpoint = config["endpoint"]
-        method = config.get("method", "GET")
-        name = config.get("name", endpoint)
-        
-        logger.info(f"📡 Calling API: {method} {endpoint}")
-        
-        # Extract request kwargs (everything except endpoint, method, name)
-        request_kwargs = {k: v for k, v in config.items() 
-                         if k not in ("endpoint", "method", "name")}
-        
-        response = _make_api_call(token, endpoint, method, **request_kwargs)
+    _set_bearer_token(token)
+    _start_upload_workers()
+    # Every upload in a batch shares the same date suffix and timestamp
+    batch_start = datetime.now()
+    date = batch_start.strftime("%Y%m%d")
+    timestamp = batch_start.isoformat()
+    futures = {}
+    
+    with ThreadPoolExecutor(max_workers=min(API_MAX_WORKERS, len(endpoints))) as executor:
+        for config in endpoints:
+            endpoint = config["endpoint"]
+            method = config.get("method", "GET")
+            # The name doubles as the S3 filename base, so sanitize the fallback here
+            name = config.get("name") or _sanitize_endpoint_name(endpoint)
+            url = config.get("url") or f"{API_BASE_URL}{endpoint}"
+            stream = bool(config.get("stream", False))
+            
+            # Extract request kwargs (everything except endpoint, method, name, url, stream)
+            request_kwargs = {k: v for k, v in config.items() 
+                             if k not in ("endpoint", "method", "name", "url", "stream")}
+            
+            logger.info(f"📡 Calling API: {method} {endpoint}")
+            
+            # The body goes straight into the document that gets uploaded
+            envelope = _open_response_envelope(endpoint, method, url, timestamp)
+            future = executor.submit(
+                _make_api_call, method, endpoint, url, request_kwargs, envelope, stream
+            )
+            futures[future] = (name, endpoint, envelope)
         
-        if response:
-            logger.info(f"✅ API call successful: {name}")
-            filepath = _save_api_response(endpoint, response, method, name=name)
-            logger.info(f"💾 Response saved to: {filepath}")
-            results[name] = response
-        else:
-            logger.error(f"❌ API call failed: {name}")
-            results[name] = None
+        responses = {}
+        for future in as_completed(futures):
+            name, endpoint, envelope = futures[future]
+            succeeded = future.result()
+            
+            if succeeded:
+                logger.info(f"✅ API call successful: {name}")
+                _UPLOAD_QUEUE.put((endpoint, envelope, name, date))
+            else:
+                logger.error(f"❌ API call failed: {name}")
+                envelope.close()
+            responses[name] = succeeded
+    
+    # Keep results in the same order as the configured endpoints
+    results = {name: responses[name] for name, _, _ in futures.values()}
     
     return results
 
@@ -305,18 +738,55 @@ def perform_api_calls(token: str, endpoints: list[dict]) -> dict[str, dict | Non
 # Login Flow Functions
 # ============================================================================
 
+# Taiga UI sets [disabled] on the tui-button host while the form is invalid
+ENABLED_SUBMIT_BUTTON_SELECTOR = 'tui-button[type="primary"]:not([disabled]) button[type="submit"]'
+
+CHROMIUM_ARGS = [
+    "--disable-blink-features=AutomationControlled",
+    "--disable-dev-shm-usage",
+    "--no-sandbox",
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-sync",
+    "--disable-translate",
+    "--mute-audio",
+    "--no-first-run",
+]
+
+# Only the login form and localStorage matter, so skip everything purely visual
+BLOCKED_RESOURCE_TYPES = frozenset({"image", "media", "font", "stylesheet"})
+
+
+def _block_non_essential_resources(route: Route) -> None:
+    """Abort requests for resources the login flow does not need."""
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        route.abort()
+    else:
+        route.continue_()
+
+
+def _wait_for_enabled_submit(page: Page, timeout: int = 15000) -> Locator:
+    """
+    Wait until the primary submit button is enabled.
+    
+    Returns:
+        Locator for the enabled button, ready to click
+    """
+    submit_btn = page.locator(ENABLED_SUBMIT_BUTTON_SELECTOR).first
+    submit_btn.wait_for(timeout=timeout)
+    return submit_btn
+
+
 def _fill_login_form(page: Page) -> None:
     """Fill the login form with email and password."""
     # Esperar inputs Angular
     page.wait_for_selector('input[formcontrolname="email"]', timeout=20000)
     page.wait_for_selector('input[formcontrolname="password"]', timeout=20000)
 
-    # Escribir como humano
-    page.click('input[formcontrolname="email"]')
-    page.keyboard.type(EMAIL, delay=50)
-
-    page.click('input[formcontrolname="password"]')
-    page.keyboard.type(PASSWORD, delay=50)
+    # fill() dispara el evento input, suficiente para que Angular valide
+    page.locator('input[formcontrolname="email"]').fill(EMAIL)
+    page.locator('input[formcontrolname="password"]').fill(PASSWORD)
 
 
 def _submit_login(page: Page) -> int:
@@ -327,14 +797,7 @@ def _submit_login(page: Page) -> int:
         HTTP status code of the login response
     """
     # Esperar que el botón se habilite
-    submit_btn = 'tui-button[type="primary"] button[type="submit"]'
-    page.wait_for_function(
-        """() => {
-            const btn = document.querySelector('tui-button[type="primary"]');
-            return btn && !btn.hasAttribute('disabled');
-        }""",
-        timeout=15000
-    )
+    submit_btn = _wait_for_enabled_submit(page)
 
     logger.info("🔐 Enviando login...")
 
@@ -343,46 +806,41 @@ def _submit_login(page: Page) -> int:
         lambda r: "/advisor/auth/login/v4" in r.url,
         timeout=20000
     ) as response_info:
-        page.click(submit_btn)
+        submit_btn.click()
 
     response = response_info.value
     logger.info(f"📡 Backend status: {response.status}")
     return response.status
 
 
-def _handle_otp_challenge(page: Page) -> int:
+def _handle_otp_challenge(page: Page, otp_requested_at: datetime | None = None) -> int:
     """
     Handle the OTP challenge step.
     
+    Args:
+        page: Playwright page on the challenge screen
+        otp_requested_at: When the login (and therefore the OTP email) was triggered
+    
     Returns:
         HTTP status code of the challenge response
     """
-    time.sleep(2)
-    
     # Esperar estar en la pantalla de challenge
     page.wait_for_url("**/challenge-code/**", timeout=30000)
     logger.info("🧩 Challenge detectado")
 
-    # Esperar input del código
+    # Esperar input del código (se renderiza junto con el cambio de URL)
     otp_input = 'input[formcontrolname="newPassword"]'
-    page.wait_for_selector(otp_input, timeout=20000)
+    page.wait_for_selector(otp_input, timeout=5000)
 
     # Obtener el código
-    otp_code = wait_for_token(WAIT_TIME_FOR_TOKEN)
+    otp_code = wait_for_token(WAIT_TIME_FOR_TOKEN, requested_at=otp_requested_at)
 
     # Escribir como humano para que Angular valide
     page.click(otp_input)
     page.keyboard.type(otp_code, delay=80)
 
     # Esperar que el botón se habilite
-    submit_btn = 'tui-button[type="primary"] button[type="submit"]'
-    page.wait_for_function(
-        """() => {
-            const btn = document.querySelector('tui-button[type="primary"]');
-            return btn && !btn.hasAttribute('disabled');
-        }""",
-        timeout=15000
-    )
+    submit_btn = _wait_for_enabled_submit(page)
 
     logger.info("🚀 Enviando challenge...")
 
@@ -391,7 +849,7 @@ def _handle_otp_challenge(page: Page) -> int:
         lambda r: "challenge" in r.url.lower(),
         timeout=20000
     ) as response_info:
-        page.click(submit_btn)
+        submit_btn.click()
 
     response = response_info.value
     logger.info(f"📡 Challenge response status: {response.status}")
@@ -406,38 +864,99 @@ def _handle_otp_challenge(page: Page) -> int:
     return response.status
 
 
-def perform_login() -> dict[str, str] | None:
+def _launch_browser(p: Playwright, storage_state: str | None = None) -> tuple[Browser, BrowserContext]:
     """
-    Perform the complete login flow.
+    Launch Chromium and create a browser context for the advisor portal.
     
+    Args:
+        p: Running Playwright instance
+        storage_state: Optional path to a saved storage state to restore
+        
     Returns:
-        Dictionary with 'idToken' and 'refreshToken' if login successful, None otherwise
+        Tuple of (browser, context)
     """
-    with sync_playwright() as p:
-        browser = p.chromium.launch(
-            headless=PLAYWRIGHT_HEADLESS,
-            args=["--disable-blink-features=AutomationControlled"]
-        )
+    browser = p.chromium.launch(
+        headless=PLAYWRIGHT_HEADLESS,
+        args=CHROMIUM_ARGS
+    )
 
+    try:
         context = browser.new_context(
             user_agent=(
                 "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
                 "AppleWebKit/537.36 (KHTML, like Gecko) "
                 "Chrome/122.0.0.0 Safari/537.36"
-            )
+            ),
+            storage_state=storage_state
         )
+    except PlaywrightError:
+        # e.g. an unreadable storage_state file; don't leave the browser running
+        browser.close()
+        raise
+    context.route("**/*", _block_non_essential_resources)
+    return browser, context
+
+
+def restore_session() -> dict[str, str] | None:
+    """
+    Read tokens from a recently saved storage state, skipping the OTP flow.
+    
+    Returns:
+        Dictionary with 'idToken' and 'refreshToken' if the saved session has them, None otherwise
+    """
+    if not _is_fresh(Path(SESSION_STATE_PATH), SESSION_STATE_TTL_SECONDS):
+        return None
+    
+    logger.info(f"♻️ Reutilizando sesión guardada en {SESSION_STATE_PATH}...")
+    
+    with sync_playwright() as p:
+        browser = None
+        try:
+            browser, context = _launch_browser(p, storage_state=SESSION_STATE_PATH)
+            page = context.new_page()
+            page.goto(
+                LOGIN_URL,
+                wait_until="domcontentloaded",
+                timeout=60000
+            )
+            tokens = _extract_tokens_from_local_storage(page, LOCAL_STORAGE_TOKEN_KEY)
+        except PlaywrightError as e:
+            logger.warning(f"⚠️ No se pudo restaurar la sesión guardada: {e}")
+            tokens = None
+        finally:
+            if browser is not None:
+                browser.close()
+    
+    if not tokens:
+        logger.warning("⚠️ La sesión guardada no contiene tokens")
+        return None
+    
+    logger.info("🔑 Tokens extraídos de la sesión guardada")
+    return tokens
+
+
+def perform_login() -> dict[str, str] | None:
+    """
+    Perform the complete login flow.
+    
+    Returns:
+        Dictionary with 'idToken' and 'refreshToken' if login successful, None otherwise
+    """
+    with sync_playwright() as p:
+        browser, context = _launch_browser(p)
 
         page = context.new_page()
 
         logger.info("🌐 Abriendo login...")
         page.goto(
             LOGIN_URL,
-            wait_until="domcontentloaded",
+            wait_until="commit",
             timeout=60000
         )
 
         # Fill and submit login form
         _fill_login_form(page)
+        otp_requested_at = datetime.now(timezone.utc)
         login_status = _submit_login(page)
 
         if login_status != 200:
@@ -446,14 +965,14 @@ def perform_login() -> dict[str, str] | None:
             return None
 
         # Handle OTP challenge
-        challenge_status = _handle_otp_challenge(page)
+        challenge_status = _handle_otp_challenge(page, otp_requested_at)
 
         if challenge_status == 200 and "/login" not in page.url.lower():
             logger.info("✅ Login OK")
             
             # Guardar sesión final (ya autenticado)
-            context.storage_state(path="session_state.json")
-            logger.info("💾 Sesión guardada en session_state.json")
+            context.storage_state(path=SESSION_STATE_PATH)
+            logger.info(f"💾 Sesión guardada en {SESSION_STATE_PATH}")
             
             # Extraer tokens de localStorage
             tokens = _extract_tokens_from_local_storage(page, LOCAL_STORAGE_TOKEN_KEY)
@@ -509,43 +1028,100 @@ def get_api_endpoints() -> list[dict]:
         {
             "endpoint": "/advisor/holdings/v2/CVAL?term=24HS",
             "method": "GET",
-            "name": "tendencias"
+            "name": "tendencias",
+            "stream": True
         },
         {
             "endpoint": "/advisor/clients/balances/v2",
             "method": "GET",
-            "name": "saldos"
+            "name": "saldos",
+            "stream": True
         },
 
     ]
     
+    # Resolve full URLs once instead of on every call and upload
+    for config in endpoints:
+        config["url"] = f"{API_BASE_URL}{config['endpoint']}"
+    
     return endpoints
 
 
-def main() -> None:
-    """Main execution function."""
+def _refresh_and_cache(tokens: dict[str, str], source: str) -> dict[str, str] | None:
+    """
+    Refresh the given tokens and persist the result.
+    
+    Args:
+        tokens: Dictionary with 'idToken' and 'refreshToken'
+        source: Where the tokens came from (for logging)
+        
+    Returns:
+        Refreshed tokens, or None if the refresh failed
+    """
+    logger.info("=" * 60)
+    logger.info(f"🔄 Refrescando token ({source})")
+    logger.info("=" * 60)
+    
+    refreshed = refresh_token(tokens["idToken"], tokens["refreshToken"])
+    if refreshed:
+        _save_cached_tokens(refreshed)
+    return refreshed
+
+
+def _get_active_token() -> str | None:
+    """
+    Get a Bearer token for the API calls, doing as little work as possible.
+    
+    Order: recent idToken on disk, REST refresh with the saved refreshToken,
+    the saved browser session, and only then the full login with OTP.
+    
+    Returns:
+        idToken to use for API calls, or None if login failed
+    """
+    cached_tokens = _load_cached_tokens()
+    
+    if cached_tokens:
+        if time.time() - cached_tokens["saved_at"] < ID_TOKEN_MAX_AGE_SECONDS:
+            logger.info("🔑 Usando idToken guardado recientemente")
+            return cached_tokens["idToken"]
+        
+        refreshed = _refresh_and_cache(cached_tokens, "tokens guardados")
+        if refreshed:
+            return refreshed["idToken"]
+        logger.warning("⚠️ Los tokens guardados no pudieron refrescarse.")
+    
+    tokens = restore_session()
+    
+    if tokens:
+        refreshed = _refresh_and_cache(tokens, "sesión guardada")
+        if refreshed:
+            return refreshed["idToken"]
+        logger.warning("⚠️ La sesión guardada no pudo refrescarse. Iniciando login completo.")
+    
     # Perform login
     tokens = perform_login()
     
     if not tokens:
-        logger.error("❌ No se pudo obtener los tokens. Abortando llamadas API.")
-        return
-    
-    id_token = tokens["idToken"]
-    refresh_token_value = tokens["refreshToken"]
+        return None
     
     # Refresh token before making API calls
-    logger.info("=" * 60)
-    logger.info("🔄 Refrescando token")
-    logger.info("=" * 60)
+    refreshed = _refresh_and_cache(tokens, "login")
     
-    refreshed_token = refresh_token(id_token, refresh_token_value)
-    
-    if not refreshed_token:
+    if not refreshed:
         logger.warning("⚠️ No se pudo refrescar el token. Usando token original.")
-        active_token = id_token
-    else:
-        active_token = refreshed_token
+        _save_cached_tokens(tokens)
+        return tokens["idToken"]
+    
+    return refreshed["idToken"]
+
+
+def main() -> None:
+    """Main execution function."""
+    active_token = _get_active_token()
+    
+    if not active_token:
+        logger.error("❌ No se pudo obtener los tokens. Abortando llamadas API.")
+        return
     
     # Get API endpoints to call
     endpoints = get_api_endpoints()
@@ -557,13 +1133,18 @@ def main() -> None:
     
     results = perform_api_calls(active_token, endpoints)
     
+    # Wait for background S3 uploads to finish
+    uploads = wait_for_uploads()
+    
     # Summary
     logger.info("=" * 60)
     logger.info("📊 Resumen de llamadas API")
     logger.info("=" * 60)
-    for name, response in results.items():
-        status = "✅" if response else "❌"
-        logger.info(f"{status} {name}: {'Exitoso' if response else 'Falló'}")
+    for name, called in results.items():
+        # A response that never reached S3 counts as a failed call
+        succeeded = called and uploads.get(name, False)
+        status = "✅" if succeeded else "❌"
+        logger.info(f"{status} {name}: {'Exitoso' if succeeded else 'Falló'}")
 
 
 if __name__ == "__main__":
@@ -3,23 +3,39 @@
 Read OTP token from Microsoft Graph Mail
 """
 
+import functools
+import html
 import os
 import re
 import requests
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from dotenv import load_dotenv
 import msal
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from utils import setup_logger
 
+try:
+    # google-re2: búsqueda en tiempo lineal, sin backtracking
+    import re2 as _otp_regex
+except ImportError:
+    _otp_regex = re
+
 # Load environment variables from .env if present
 load_dotenv()
 
+logger = setup_logger("dracma.login_inviu", "INFO")
+
 # Configuration from environment
 TENANT_ID = os.getenv("TENANT_ID")
 CLIENT_ID = os.getenv("CLIENT_ID")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 MAILBOX_UPN = os.getenv("MAILBOX_UPN")
+# Remitentes del OTP separados por coma (vacío = no filtrar por remitente)
+OTP_SENDERS = os.getenv("OTP_SENDERS", "")
 
 # Validación básica
 for k, v in {
@@ -31,20 +47,96 @@ for k, v in {
     if not v:
         raise RuntimeError(f"Falta variable de entorno: {k}")
 
+# Patrones compilados una sola vez al importar
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
 
-def get_graph_token() -> str:
+# Patrones de OTP, en orden de preferencia: número aislado de 4-8 dígitos
+# (el de 6 es el más común), palabra clave seguida de 4-8 dígitos, y como
+# último recurso 4-8 dígitos al final de línea o seguidos de espacio.
+# Sin lookarounds ni flags para que también compilen con RE2;
+# el \u00a0 (&nbsp; decodificado) va literal porque el \s de RE2 es ASCII
+_OTP_SPACE = "\\s\u00a0"
+_OTP_NUMBER_RE = _otp_regex.compile(r'\b(\d{4,8})\b')
+# En minúscula: se busca sobre el texto ya pasado a minúscula, sin plegado
+# de mayúsculas dentro del motor
+_OTP_KEYWORD_RE = _otp_regex.compile(r'(?:código|code|otp|token)[' + _OTP_SPACE + r':]*(\d{4,8})')
+_OTP_TAIL_RE = _otp_regex.compile(r'(\d{4,8})(?:[' + _OTP_SPACE + r']|$)')
+_OTP_KEYWORDS = ("código", "code", "otp", "token")
+_DIGITS = "0123456789"
+
+# Remitentes permitidos, normalizados para comparar sin mayúsculas
+_OTP_SENDERS = frozenset(
+    sender.strip().lower() for sender in OTP_SENDERS.split(",") if sender.strip()
+)
+
+# Ventana por defecto para buscar el email del OTP
+_DEFAULT_LOOKBACK = timedelta(minutes=10)
+
+# Pedir a Graph el body ya convertido a texto plano
+_PREFER_TEXT_BODY = 'outlook.body-content-type="text"'
+
+# El OTP viene al principio del email: no escanear más allá de este prefijo
+_OTP_SCAN_LIMIT = 4096
+
+# Graph corta bodyPreview en 255 caracteres; uno más corto es el body entero
+_PREVIEW_MAX_CHARS = 255
+
+# Máximo de subrequests que Graph acepta en un $batch
+_GRAPH_BATCH_LIMIT = 20
+
+
+def _build_graph_session() -> requests.Session:
     """
-    Obtener token de Microsoft Graph usando Client Credentials.
+    Crear una Session con pool de conexiones para Microsoft Graph.
     
     Returns:
-        Access token string
+        requests Session configurada
+    """
+    session = requests.Session()
+    retries = Retry(
+        total=2,
+        backoff_factor=0.2,
+        status_forcelist=[429, 500, 502, 503, 504],
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries)
+    session.mount("https://", adapter)
+    session.headers["Accept"] = "application/json"
+    return session
+
+
+# Compartida por todas las llamadas a Graph para reutilizar la conexión TLS
+_SESSION = _build_graph_session()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_msal_app() -> msal.ConfidentialClientApplication:
+    """
+    Obtener la aplicación MSAL, creada una sola vez por proceso.
+    
+    Reutilizarla evita repetir el discovery del authority y permite que MSAL
+    devuelva el access token desde su cache en memoria mientras no expire.
+    
+    Returns:
+        ConfidentialClientApplication configurada
     """
-    app = msal.ConfidentialClientApplication(
+    return msal.ConfidentialClientApplication(
         CLIENT_ID,
         authority=f"https://login.microsoftonline.com/{TENANT_ID}",
         client_credential=CLIENT_SECRET,
+        token_cache=msal.TokenCache(),
+        http_client=_SESSION,
     )
 
+
+def get_graph_token() -> str:
+    """
+    Obtener token de Microsoft Graph usando Client Credentials.
+    
+    Returns:
+        Access token string
+    """
+    app = _get_msal_app()
+
     result = app.acquire_token_for_client(
         scopes=["https://graph.microsoft.com/.default"]
     )
@@ -55,68 +147,121 @@ def get_graph_token() -> str:
     return result["access_token"]
 
 
-def read_last_messages(token: str, top: int = 10) -> list:
+def read_last_messages(token: str, top: int = 10, received_after: Optional[datetime] = None) -> list:
     """
     Leer últimos mensajes de Graph Mail.
     
+    Los filtros por fecha y por remitente (OTP_SENDERS) se aplican del lado
+    de Graph. Solo se pide el bodyPreview; el body completo se lee aparte si
+    hace falta.
+    
     Args:
         token: Access token de Microsoft Graph
         top: Número de mensajes a leer
+        received_after: Solo mensajes recibidos desde esta fecha
+            (por defecto, los últimos 10 minutos)
         
     Returns:
         Lista de mensajes
     """
+    if received_after is None:
+        received_after = datetime.now(timezone.utc) - _DEFAULT_LOOKBACK
+    received_after_utc = received_after.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    
+    # receivedDateTime va primero en el filtro porque también está en $orderby
+    filters = [f"receivedDateTime ge {received_after_utc}"]
+    if _OTP_SENDERS:
+        # Comillas simples duplicadas según OData
+        escaped = [sender.replace("'", "''") for sender in sorted(_OTP_SENDERS)]
+        sender_clauses = " or ".join(
+            f"from/emailAddress/address eq '{sender}'" for sender in escaped
+        )
+        filters.append(f"({sender_clauses})")
+    
     url = f"https://graph.microsoft.com/v1.0/users/{MAILBOX_UPN}/messages"
     params = {
         "$top": str(top),
+        "$filter": " and ".join(filters),
         "$orderby": "receivedDateTime DESC",
-        "$select": "id,subject,from,receivedDateTime,body,bodyPreview",
+        "$select": "id,subject,from,receivedDateTime,bodyPreview",
     }
     headers = {
         "Authorization": f"Bearer {token}",
-        "Accept": "application/json",
+        "Prefer": _PREFER_TEXT_BODY,
     }
 
-    resp = requests.get(url, headers=headers, params=params, timeout=30)
+    resp = _SESSION.get(url, headers=headers, params=params, timeout=30)
     resp.raise_for_status()
-    return resp.json()["value"]
+    return orjson.loads(resp.content)["value"]
 
 
-def get_message_body(token: str, message_id: str) -> str:
+def _extract_body_text(message: dict) -> str:
     """
-    Obtener el body completo de un mensaje.
+    Obtener el texto del body de un mensaje de Graph.
+    
+    Args:
+        message: Mensaje de Graph con el campo body
+        
+    Returns:
+        Body del mensaje como string (vacío si no viene)
+    """
+    # Pedimos texto plano con el header Prefer, pero Graph puede
+    # devolver HTML igual (p.ej. si ignora la preferencia)
+    body_content = message.get("body") or {}
+    body_text = body_content.get("content") or ""
+    
+    # Si es HTML, intentar extraer texto básico
+    if body_content.get("contentType") == "html":
+        # Remover tags HTML básicos (simple approach), solo si hay alguno
+        if '<' in body_text:
+            body_text = _HTML_TAG_RE.sub('', body_text)
+        body_text = html.unescape(body_text)
+    
+    return body_text
+
+
+def get_message_bodies(token: str, message_ids: list[str]) -> dict[str, str]:
+    """
+    Obtener el body de varios mensajes con requests $batch de Graph.
     
     Args:
         token: Access token de Microsoft Graph
-        message_id: ID del mensaje
+        message_ids: IDs de los mensajes
         
     Returns:
-        Body del mensaje como string
+        Diccionario id de mensaje -> body como string (omite los que fallaron)
     """
-    url = f"https://graph.microsoft.com/v1.0/users/{MAILBOX_UPN}/messages/{message_id}"
-    params = {
-        "$select": "body",
-    }
+    url = "https://graph.microsoft.com/v1.0/$batch"
     headers = {
         "Authorization": f"Bearer {token}",
-        "Accept": "application/json",
     }
-
-    resp = requests.get(url, headers=headers, params=params, timeout=30)
-    resp.raise_for_status()
-    message = resp.json()
-    
-    # El body puede venir en formato HTML o texto
-    body_content = message.get("body", {})
-    body_text = body_content.get("content", "")
+    bodies = {}
     
-    # Si es HTML, intentar extraer texto básico
-    if body_content.get("contentType") == "html":
-        # Remover tags HTML básicos (simple approach)
-        body_text = re.sub(r'<[^>]+>', '', body_text)
-        body_text = body_text.replace('&nbsp;', ' ').replace('&amp;', '&')
+    for start in range(0, len(message_ids), _GRAPH_BATCH_LIMIT):
+        chunk = message_ids[start:start + _GRAPH_BATCH_LIMIT]
+        payload = {
+            "requests": [
+                {
+                    "id": str(index),
+                    "method": "GET",
+                    "url": f"/users/{MAILBOX_UPN}/messages/{message_id}?$select=body",
+                    "headers": {"Prefer": _PREFER_TEXT_BODY},
+                }
+                for index, message_id in enumerate(chunk)
+            ]
+        }
+        
+        resp = _SESSION.post(url, headers=headers, json=payload, timeout=30)
+        resp.raise_for_status()
+        
+        for response in orjson.loads(resp.content).get("responses", []):
+            message_id = chunk[int(response["id"])]
+            if response.get("status") != 200:
+                logger.warning(f"Error leyendo body del mensaje {message_id}: status {response.get('status')}")
+                continue
+            bodies[message_id] = _extract_body_text(response.get("body") or {})
     
-    return body_text
+    return bodies
 
 
 def extract_otp_from_text(text: str) -> Optional[str]:
@@ -130,55 +275,112 @@ def extract_otp_from_text(text: str) -> Optional[str]:
     Returns:
         Código OTP encontrado o None
     """
-    # Buscar patrones comunes de OTP:
-    # - Números de 4-8 dígitos
-    # - Palabras clave como "código", "code", "OTP", "token" seguidas de números
-    patterns = [
-        r'\b(\d{6})\b',  # 6 dígitos (más común)
-        r'\b(\d{4,8})\b',  # 4-8 dígitos
-        r'(?:código|code|OTP|token)[\s:]*(\d{4,8})',  # Con palabra clave
-        r'(\d{4,8})(?:\s|$)',  # Al final de línea o seguido de espacio
-    ]
+    # Sin dígitos no puede haber OTP: evitar entrar al motor de regex
+    if not any(digit in text for digit in _DIGITS):
+        return None
     
-    for pattern in patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        if matches:
-            # Retornar el primer match que tenga 6 dígitos, o el primero disponible
-            for match in matches:
-                if len(match) >= 6:
-                    return match
-            return matches[0]
+    # Números aislados: cortar en el primero de 6 dígitos
+    best = None
+    for match in _OTP_NUMBER_RE.finditer(text):
+        candidate = match.group(1)
+        if len(candidate) == 6:
+            return candidate
+        # Si no, preferir el primero de 7-8 dígitos sobre uno de 4-5
+        if best is None or len(best) < 6 <= len(candidate):
+            best = candidate
+    if best:
+        return best
+    
+    # El patrón con palabra clave solo hace falta si alguna aparece
+    lowered = text.lower()
+    if any(keyword in lowered for keyword in _OTP_KEYWORDS):
+        otp = _first_long_match(_OTP_KEYWORD_RE.findall(lowered))
+        if otp:
+            return otp
+    
+    return _first_long_match(_OTP_TAIL_RE.findall(text))
+
+
+def _first_long_match(matches: list) -> Optional[str]:
+    """
+    Elegir el primer match de 6 o más dígitos, o el primero si no hay.
+    
+    Args:
+        matches: Candidatos en orden de aparición
+        
+    Returns:
+        Código elegido o None si no hay candidatos
+    """
+    for match in matches:
+        if len(match) >= 6:
+            return match
+    return matches[0] if matches else None
+
+
+def _parse_received_datetime(message: dict) -> Optional[datetime]:
+    """
+    Parsear el receivedDateTime (ISO 8601 UTC) de un mensaje de Graph.
     
-    return None
+    Args:
+        message: Mensaje devuelto por Graph
+        
+    Returns:
+        Fecha de recepción con zona horaria o None si no se puede parsear
+    """
+    raw = message.get("receivedDateTime")
+    if not raw:
+        return None
+    try:
+        return datetime.fromisoformat(raw.replace("Z", "+00:00"))
+    except ValueError:
+        return None
 
 
-def get_opt_token() -> Optional[str]:
+def get_opt_token(received_after: Optional[datetime] = None) -> Optional[str]:
     """
     Obtener el código OTP del email más reciente usando Microsoft Graph Mail.
     
+    Args:
+        received_after: Si se indica (con zona horaria), ignorar mensajes
+            recibidos antes de esta fecha
+    
     Returns:
         Código OTP encontrado o None
     """
-    logger = setup_logger("dracma.login_inviu", "INFO")
-    
     try:
         logger.info("Obteniendo token de Microsoft Graph...")
         token = get_graph_token()
         logger.info("Token obtenido exitosamente")
         
         logger.info(f"Leyendo mensajes de: {MAILBOX_UPN}")
-        messages = read_last_messages(token, top=10)
+        messages = read_last_messages(token, top=3, received_after=received_after)
         
         if not messages:
             logger.warning("No se encontraron mensajes")
             return None
         
         # Buscar OTP en los mensajes más recientes
+        pending_ids = []
         for message in messages:
             message_id = message.get("id")
             subject = message.get("subject", "")
             body_preview = message.get("bodyPreview", "")
             
+            if received_after is not None:
+                received_at = _parse_received_datetime(message)
+                if received_at is None:
+                    continue
+                # Los mensajes vienen ordenados por fecha descendente
+                if received_at < received_after:
+                    logger.info("No hay mensajes nuevos desde que se pidió el OTP")
+                    break
+            
+            if _OTP_SENDERS:
+                sender = ((message.get("from") or {}).get("emailAddress") or {}).get("address") or ""
+                if sender.lower() not in _OTP_SENDERS:
+                    logger.info(f"Ignorando mensaje de remitente no esperado: {sender}")
+                    continue
+            
             logger.info(f"Revisando mensaje: {subject[:50]}...")
             
             # Primero intentar con el preview
@@ -187,17 +389,27 @@ def get_opt_token() -> Optional[str]:
                 logger.info(f"OTP encontrado en preview: {otp}")
                 return otp
             
-            # Si no se encuentra en el preview, leer el body completo
-            if message_id:
-                try:
-                    body_text = get_message_body(token, message_id)
-                    otp = extract_otp_from_text(body_text)
-                    if otp:
-                        logger.info(f"OTP encontrado en body completo: {otp}")
-                        return otp
-                except Exception as e:
-                    logger.warning(f"Error leyendo body completo del mensaje {message_id}: {e}")
-                    continue
+            # Pedir el body completo solo si el preview podría esconder el OTP:
+            # tiene dígitos o está cortado por Graph
+            might_have_otp = (
+                len(body_preview) >= _PREVIEW_MAX_CHARS
+                or any(digit in body_preview for digit in _DIGITS)
+            )
+            if message_id and might_have_otp:
+                pending_ids.append(message_id)
+        
+        if pending_ids:
+            try:
+                bodies = get_message_bodies(token, pending_ids)
+            except Exception as e:
+                logger.warning(f"Error leyendo body completo de {len(pending_ids)} mensajes: {e}")
+                bodies = {}
+            
+            for message_id in pending_ids:
+                otp = extract_otp_from_text(bodies.get(message_id, "")[:_OTP_SCAN_LIMIT])
+                if otp:
+                    logger.info(f"OTP encontrado en body completo: {otp}")
+                    return otp
         
         logger.warning("No se encontró código OTP en los mensajes revisados")
         return None
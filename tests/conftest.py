@@ -0,0 +1,9 @@
+import os
+import sys
+from pathlib import Path
+
+# main.py and opt_token.py validate these at import time
+for _name in ("EMAIL", "PASSWORD", "TENANT_ID", "CLIENT_ID", "CLIENT_SECRET", "MAILBOX_UPN"):
+    os.environ.setdefault(_name, f"test-{_name.lower()}")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,192 @@
+import io
+import queue
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import orjson
+
+import main
+
+
+def _use_transport(monkeypatch, handler):
+    client = httpx.Client(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(main, "_HTTP_CLIENT", client)
+    return client
+
+
+def _call(**kwargs):
+    sink = io.BytesIO()
+    ok = main._make_api_call(
+        "GET", "/advisor/test", "https://api.test/advisor/test", {}, sink, **kwargs
+    )
+    return ok, sink.getvalue()
+
+
+class _FakeS3:
+    def __init__(self):
+        self.uploads = {}
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None, Config=None):
+        self.uploads[key] = fileobj.read()
+
+
+def test_make_api_call_writes_body(monkeypatch):
+    _use_transport(monkeypatch, lambda request: httpx.Response(200, json={"ok": True}))
+
+    assert _call() == (True, b'{"ok":true}')
+
+
+def test_make_api_call_fails_on_error_status(monkeypatch):
+    monkeypatch.setattr(main, "API_RETRY_BACKOFF_SECONDS", 0)
+    _use_transport(monkeypatch, lambda request: httpx.Response(404, json={"error": "missing"}))
+
+    assert _call() == (False, b"")
+
+
+def test_make_api_call_retries_transient_status(monkeypatch):
+    monkeypatch.setattr(main, "API_RETRY_BACKOFF_SECONDS", 0)
+    statuses = iter([503, 200])
+    _use_transport(monkeypatch, lambda request: httpx.Response(next(statuses), json=[1]))
+
+    assert _call() == (True, b"[1]")
+
+
+def test_make_api_call_rejects_non_json(monkeypatch):
+    _use_transport(monkeypatch, lambda request: httpx.Response(200, text="<html></html>"))
+
+    assert _call() == (False, b"")
+
+
+def test_make_api_call_streams_body_into_sink(monkeypatch):
+    chunks = [b'{"items":[', b"1,2,3", b"]}"]
+    _use_transport(
+        monkeypatch,
+        lambda request: httpx.Response(
+            200,
+            headers={"content-type": "application/json"},
+            stream=httpx.ByteStream(b"".join(chunks)),
+        ),
+    )
+
+    assert _call(stream=True) == (True, b'{"items":[1,2,3]}')
+
+
+def test_perform_api_calls_uploads_envelopes(monkeypatch):
+    def handler(request):
+        if request.url.path == "/broken":
+            return httpx.Response(400, json={"error": "bad"})
+        return httpx.Response(200, json={"path": request.url.path})
+
+    _use_transport(monkeypatch, handler)
+    upload_queue = queue.Queue()
+    monkeypatch.setattr(main, "_UPLOAD_QUEUE", upload_queue)
+    monkeypatch.setattr(main, "_start_upload_workers", lambda: None)
+    s3 = _FakeS3()
+    monkeypatch.setattr(main, "_get_s3_client", lambda: s3)
+
+    results = main.perform_api_calls(
+        "token",
+        [
+            {"endpoint": "/a", "name": "a", "url": "https://api.test/a"},
+            {"endpoint": "/broken", "name": "broken", "url": "https://api.test/broken"},
+            {"endpoint": "/b", "name": "b", "url": "https://api.test/b", "stream": True},
+        ],
+    )
+
+    assert results == {"a": True, "broken": False, "b": True}
+    while not upload_queue.empty():
+        endpoint, envelope, name, date = upload_queue.get()
+        main._save_api_response(endpoint, envelope, name=name, date=date)
+        envelope.close()
+
+    documents = {key: orjson.loads(body) for key, body in s3.uploads.items()}
+    assert sorted(documents) == sorted(f"{main.S3_PREFIX}/{n}_{date}.json" for n in ("a", "b"))
+    document = documents[f"{main.S3_PREFIX}/b_{date}.json"]
+    assert document["data"] == {"path": "/b"}
+    assert document["endpoint"] == "/b"
+    assert document["url"] == "https://api.test/b"
+
+
+def _record_sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(main.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_send_with_retries_honours_retry_after(monkeypatch):
+    sleeps = _record_sleeps(monkeypatch)
+    responses = iter([
+        httpx.Response(429, headers={"Retry-After": "2"}),
+        httpx.Response(503, headers={"Retry-After": "3600"}),
+        httpx.Response(503),
+        httpx.Response(200, json=[]),
+    ])
+    _use_transport(monkeypatch, lambda request: next(responses))
+
+    response = main._send_with_retries("GET", "https://api.test/x")
+
+    assert response.status_code == 200
+    assert sleeps == [
+        2.0,
+        main.API_RETRY_AFTER_MAX_SECONDS,
+        main.API_RETRY_BACKOFF_SECONDS * 4,
+    ]
+
+
+def test_retry_after_accepts_http_dates():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=10)
+    response = httpx.Response(429, headers={"Retry-After": format_datetime(retry_at, usegmt=True)})
+
+    assert 8 <= main._retry_after_seconds(response) <= 10
+    assert main._retry_after_seconds(httpx.Response(429, headers={"Retry-After": "soon"})) is None
+    assert main._retry_after_seconds(httpx.Response(500, headers={"Retry-After": "5"})) is None
+
+
+def test_make_api_call_rejects_empty_bodies(monkeypatch):
+    _use_transport(
+        monkeypatch,
+        lambda request: httpx.Response(200, headers={"content-type": "application/json"}),
+    )
+
+    assert _call()[0] is False
+    assert _call(stream=True)[0] is False
+
+
+def test_make_api_call_rejects_invalid_json(monkeypatch):
+    _use_transport(
+        monkeypatch,
+        lambda request: httpx.Response(
+            200, headers={"content-type": "application/json"}, content=b"<html>oops"
+        ),
+    )
+
+    assert _call() == (False, b"")
+
+
+def test_wait_for_uploads_reports_failed_uploads(monkeypatch):
+    class _FailingS3(_FakeS3):
+        def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None, Config=None):
+            if "/b_" in key:
+                raise main.S3UploadFailedError("denied")
+            super().upload_fileobj(fileobj, bucket, key, ExtraArgs, Config)
+
+    _use_transport(monkeypatch, lambda request: httpx.Response(200, json={"ok": True}))
+    monkeypatch.setattr(main, "_UPLOAD_QUEUE", queue.Queue())
+    monkeypatch.setattr(main, "_UPLOAD_WORKERS", [])
+    monkeypatch.setattr(main, "_UPLOAD_RESULTS", {})
+    monkeypatch.setattr(main, "S3_UPLOAD_WORKERS", 1)
+    s3 = _FailingS3()
+    monkeypatch.setattr(main, "_get_s3_client", lambda: s3)
+
+    results = main.perform_api_calls(
+        "token",
+        [
+            {"endpoint": "/a", "name": "a", "url": "https://api.test/a"},
+            {"endpoint": "/b", "name": "b", "url": "https://api.test/b"},
+        ],
+    )
+
+    assert results == {"a": True, "b": True}
+    assert main.wait_for_uploads() == {"a": True, "b": False}
+    assert main.wait_for_uploads() == {}
@@ -0,0 +1,109 @@
+import random
+import re
+
+import orjson
+import pytest
+import requests
+
+import opt_token
+
+
+def _baseline_extract_otp(text):
+    """extract_otp_from_text as it was before the regex was optimized."""
+    patterns = [
+        r'\b(\d{6})\b',
+        r'\b(\d{4,8})\b',
+        r'(?:código|code|OTP|token)[\s:]*(\d{4,8})',
+        r'(\d{4,8})(?:\s|$)',
+    ]
+    for pattern in patterns:
+        matches = re.findall(pattern, text, re.IGNORECASE)
+        if matches:
+            for match in matches:
+                if len(match) >= 6:
+                    return match
+            return matches[0]
+    return None
+
+
+def _json_response(payload, status=200):
+    response = requests.Response()
+    response.status_code = status
+    response._content = orjson.dumps(payload)
+    return response
+
+
+def _batch_response(*items):
+    return _json_response({
+        "responses": [
+            {"id": str(index), "status": status, "body": body}
+            for index, (status, body) in enumerate(items)
+        ]
+    })
+
+
+def test_get_message_bodies_skips_failed_subrequests(monkeypatch):
+    batch = _batch_response(
+        (200, {"body": {"contentType": "text", "content": "Tu código es 123456"}}),
+        (429, {"error": {"code": "TooManyRequests"}}),
+    )
+    monkeypatch.setattr(opt_token._SESSION, "post", lambda *args, **kwargs: batch)
+
+    bodies = opt_token.get_message_bodies("token", ["m1", "m2"])
+
+    assert bodies == {"m1": "Tu código es 123456"}
+
+
+def test_get_opt_token_uses_bodies_from_partial_batch(monkeypatch):
+    messages = [
+        {"id": "m1", "subject": "Acceso", "bodyPreview": "Hola 12"},
+        {"id": "m2", "subject": "Otro", "bodyPreview": "Ref 34"},
+    ]
+    batch = _batch_response(
+        (200, {"body": {"contentType": "text", "content": "Tu código es 123456"}}),
+        (429, {"error": {"code": "TooManyRequests"}}),
+    )
+    monkeypatch.setattr(opt_token, "get_graph_token", lambda: "token")
+    monkeypatch.setattr(opt_token, "read_last_messages", lambda *args, **kwargs: messages)
+    monkeypatch.setattr(opt_token._SESSION, "post", lambda *args, **kwargs: batch)
+
+    assert opt_token.get_opt_token() == "123456"
+
+
+@pytest.mark.parametrize("text, expected", [
+    # Sin dígitos o sin números de 4-8 dígitos
+    ("Hola, sin código", None),
+    ("sin OTP 12 34", None),
+    # Número aislado de 6 dígitos antes que cualquier otro
+    ("Ref 12345678, código 4321, clave 654321", "654321"),
+    # Sin 6 dígitos: el primero de 7-8 antes que uno de 4-5
+    ("Ref 1234 y 12345678", "12345678"),
+    ("Ref 1234 y 98765", "1234"),
+    # Un número aislado gana a la palabra clave pegada a texto
+    ("code12345x 9876", "9876"),
+    # Palabra clave, en cualquier caja y con &nbsp; decodificado
+    ("CÓDIGO:12345678abc", "12345678"),
+    ("token:4321abc", "4321"),
+    ("Tu codigo OTP:\xa0246810x", "246810"),
+    ("Tu código es\xa0135790", "135790"),
+    # Último recurso: dígitos pegados a texto al final de línea o antes de espacio
+    ("ABC123456 ", "123456"),
+    ("x1234 y", "1234"),
+])
+def test_extract_otp_preference_order(text, expected):
+    assert opt_token.extract_otp_from_text(text) == expected
+
+
+@pytest.mark.skipif(
+    opt_token._otp_regex is not re,
+    reason="RE2's \\b is ASCII-only, so digits next to accented letters differ",
+)
+def test_extract_otp_matches_baseline_on_random_text():
+    rng = random.Random(1)
+    pieces = [
+        "code", "otp", "OTP", "token", "código", " ", ":", "\n", "\xa0", "x", "ó", ".",
+        "9", "1234", "12345", "123456", "1234567", "12345678",
+    ]
+    for _ in range(20000):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 8)))
+        assert opt_token.extract_otp_from_text(text) == _baseline_extract_otp(text), repr(text)
@@ -0,0 +1,94 @@
+import os
+import random
+
+import pytest
+
+import utils
+
+
+def _baseline_parse_env(text):
+    """load_env_file's line-by-line parsing before the single regex pass."""
+    parsed = {}
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            continue
+        if stripped.startswith("export "):
+            stripped = stripped[len("export "):].strip()
+        if "=" not in stripped:
+            continue
+        key, value = stripped.split("=", 1)
+        parsed[key.strip()] = value.strip().strip('"').strip("'")
+    return parsed
+
+
+ENV_TEXT = """\
+# comentario
+A=1
+  export B = "two words"
+C='x y'
+D=
+E=has#hash
+not a line
+F = spaced   
+MY-VAR=dashed
+G="abc
+H="a"b
+   # indented comment=ignored
+I=x=y
+"""
+
+
+@pytest.fixture
+def env_file(tmp_path, monkeypatch):
+    path = tmp_path / ".env"
+    path.write_text(ENV_TEXT)
+    for key in ("A", "B", "C", "D", "E", "F", "MY-VAR", "G", "H", "I"):
+        monkeypatch.delenv(key, raising=False)
+    yield path
+    for key in ("A", "B", "C", "D", "E", "F", "MY-VAR", "G", "H", "I"):
+        os.environ.pop(key, None)
+
+
+def test_load_env_file_parses_assignments(env_file):
+    utils.load_env_file(str(env_file))
+
+    assert {key: os.environ.get(key) for key in ("A", "B", "C", "D", "E", "F", "MY-VAR", "G", "H", "I")} == {
+        "A": "1",
+        "B": "two words",
+        "C": "x y",
+        "D": "",
+        "E": "has#hash",
+        "F": "spaced",
+        "MY-VAR": "dashed",
+        "G": "abc",
+        "H": 'a"b',
+        "I": "x=y",
+    }
+    assert "# indented comment" not in os.environ
+
+
+def test_load_env_file_keeps_existing_values_unless_override(env_file, monkeypatch):
+    monkeypatch.setenv("A", "kept")
+
+    utils.load_env_file(str(env_file))
+    assert os.environ["A"] == "kept"
+
+    utils.load_env_file(str(env_file), override=True)
+    assert os.environ["A"] == "1"
+
+
+def test_env_regex_matches_baseline_on_random_text():
+    rng = random.Random(2)
+    pieces = ["A", "B-1", "=", "  ", "\t", "#", "export ", "export", "'", '"', "x", "\n", "\r\n"]
+    for _ in range(20000):
+        text = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 12)))
+        expected = _baseline_parse_env(text)
+        if "" in expected:
+            # The baseline raised ValueError setting an empty variable name
+            continue
+        parsed = {
+            match.group(1).strip(): match.group(2).strip().strip('"').strip("'")
+            for match in utils._ENV_RE.finditer(text)
+        }
+        assert parsed == expected, repr(text)
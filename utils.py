@@ -6,21 +6,53 @@ version = 1
 print(f"utils version: {version}")
 
 import os
+import re
 import sys
-import json
+import time
 import logging
-from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict
 
+import orjson
+
+
+_LEVELS = {
+    "DEBUG": logging.DEBUG,
+    "INFO": logging.INFO,
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "CRITICAL": logging.CRITICAL,
+}
+
+# One KEY=value assignment per line, optionally prefixed by "export ";
+# lines starting with "#" and lines without "=" are skipped
+_ENV_RE = re.compile(
+    r'^[ \t]*(?![ \t#])(?:export )?[ \t]*([^=\s][^=\r\n]*)=([^\r\n]*)',
+    re.MULTILINE,
+)
 
 
 class JSONFormatter(logging.Formatter):
     """Custom JSON formatter for AWS CloudWatch logs"""
     
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Last formatted second, so strftime runs at most once per second
+        self._cached_second = None
+        self._cached_prefix = ""
+    
+    def _format_timestamp(self, created: float) -> str:
+        """Format a record's creation time as ISO 8601 UTC with microseconds"""
+        second = int(created)
+        if second != self._cached_second:
+            self._cached_prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+            self._cached_second = second
+        micros = int((created - second) * 1_000_000)
+        return f"{self._cached_prefix}.{micros:06d}Z"
+    
     def format(self, record: logging.LogRecord) -> str:
         log_data: Dict[str, Any] = {
-            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "timestamp": self._format_timestamp(record.created),
             "level": record.levelname,
             "message": record.getMessage(),
             "module": record.module,
@@ -33,10 +65,11 @@ class JSONFormatter(logging.Formatter):
             log_data["exception"] = self.formatException(record.exc_info)
         
         # Add extra fields if present
-        if hasattr(record, "extra"):
-            log_data.update(record.extra)
+        extra = getattr(record, "extra", None)
+        if extra:
+            log_data.update(extra)
         
-        return json.dumps(log_data, ensure_ascii=False)
+        return orjson.dumps(log_data).decode()
 
 
 def load_env_file(env_path: str = ".env", override: bool = False) -> None:
@@ -47,18 +80,9 @@ def load_env_file(env_path: str = ".env", override: bool = False) -> None:
     if not env_file.exists():
         return
 
-    for line in env_file.read_text().splitlines():
-        stripped = line.strip()
-        if not stripped or stripped.startswith("#"):
-            continue
-        if stripped.startswith("export "):
-            stripped = stripped[len("export "):].strip()
-        if "=" not in stripped:
-            continue
-
-        key, value = stripped.split("=", 1)
-        key = key.strip()
-        value = value.strip().strip('"').strip("'")
+    for match in _ENV_RE.finditer(env_file.read_text()):
+        key = match.group(1).strip()
+        value = match.group(2).strip().strip('"').strip("'")
 
         if not override and key in os.environ:
             continue
@@ -78,7 +102,11 @@ def setup_logger(name: str = "dracma", level: str = "INFO") -> logging.Logger:
         Configured logger instance
     """
     logger = logging.getLogger(name)
-    logger.setLevel(getattr(logging, level.upper(), logging.INFO))
+    logger.setLevel(_LEVELS.get(level.upper(), logging.INFO))
+    
+    # Already has our JSON handler: only the level needed updating
+    if getattr(logger, "_dracma_configured", False) and logger.handlers:
+        return logger
     
     # Remove existing handlers to avoid duplicates
     logger.handlers.clear()
@@ -96,6 +124,7 @@ def setup_logger(name: str = "dracma", level: str = "INFO") -> logging.Logger:
     # Prevent propagation to root logger
     logger.propagate = False
     
+    logger._dracma_configured = True
     return logger
 
 